@@ -0,0 +1,50 @@
+import sys
+import time
+
+import numpy as np
+
+from hip.models import MEMORY_WINDOW, TensorHIP
+
+# Time `bootstrap` end to end for a growing number of samples on a series
+# simulated from the HIP model. The batched refit is only worth it when its
+# cost grows sub-linearly in the number of samples, so this exits with a
+# non-zero status when NUM_SAMPLES[-1] samples take longer than refitting
+# them one at a time would.
+SERIES_LENGTH = 300
+NUM_SAMPLES = [1, 8, 32]
+NUM_REPEATS = 3
+
+def make_series(seed=0, eta=0.5, mu=(1.0, 0.5), theta=1.0, C=1.0, noise=0.1):
+    random_state = np.random.RandomState(seed)
+    x = random_state.poisson(5, size=(2, SERIES_LENGTH)).astype(float)
+    kernel = (np.arange(MEMORY_WINDOW, 0, -1) + 1 + 0.01) ** (-1 - theta)
+    y = np.zeros(MEMORY_WINDOW + SERIES_LENGTH)
+    for t in range(SERIES_LENGTH):
+        history = y[t:t + MEMORY_WINDOW]
+        y[t + MEMORY_WINDOW] = eta + np.dot(mu, x[:, t]) + C * np.dot(history, kernel) + noise * random_state.randn()
+    return x[np.newaxis], [y[MEMORY_WINDOW:]]
+
+def time_bootstrap(model, num_samples, num_repeats):
+    times = []
+    for _ in range(num_repeats):
+        start_time = time.time()
+        model.bootstrap(num_samples=num_samples)
+        times.append(time.time() - start_time)
+    return min(times)
+
+if __name__ == '__main__':
+    xs, ys = make_series()
+    model = TensorHIP(xs, ys, scale_series=False, num_initializations=2, max_iterations=500)
+    model.train()
+
+    times = dict()
+    for num_samples in NUM_SAMPLES:
+        times[num_samples] = time_bootstrap(model, num_samples, NUM_REPEATS)
+        sys.stderr.write("num_samples={}: {:.3f}s\n".format(num_samples, times[num_samples]))
+
+    for num_samples in NUM_SAMPLES[1:]:
+        print("{} samples: {:.2f}x the time of 1 sample".format(num_samples, times[num_samples] / times[1]))
+
+    if times[NUM_SAMPLES[-1]] >= NUM_SAMPLES[-1] * times[1]:
+        print("bootstrap cost does not grow sub-linearly with the number of samples")
+        sys.exit(1)
@@ -0,0 +1,87 @@
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from hip.models import TensorHIP
+
+# Compare the per-iteration cost of the default dynamic-shape graph with the
+# static-shape graph of the compiled mode on a long synthetic series, after
+# checking that both give the same predictions. XLA only compiles the static
+# graph when the tensorflow build has an XLA_CPU device. One iteration is
+# a single evaluation of the loss and its gradient, which is what L-BFGS-B
+# requests from the session at every step of the optimization.
+SERIES_LENGTH = 5000
+NUM_EXOGENOUS_SERIES = 4
+NUM_ITERATIONS = 50
+
+def make_series(series_length, num_exogenous_series, seed=0):
+    random_state = np.random.RandomState(seed)
+    xs = random_state.poisson(5, size=(1, num_exogenous_series, series_length))
+    ys = np.convolve(xs[0].sum(axis=0), np.ones(7) / 7, mode='same')
+    return xs, [ys]
+
+def check_predictions(models):
+    """
+        Both modes have to give the same predictions for the same parameters
+    """
+    model_params = {
+        'eta': np.float32(0.1),
+        'mu': np.full((1, NUM_EXOGENOUS_SERIES), 0.2, dtype=np.float32),
+        'theta': np.float32(1.0),
+        'C': np.float32(0.5),
+        'c': np.float32(1.0),
+    }
+    predictions = []
+    for model in models:
+        model.model_params = dict(model_params)
+        predictions.append(model.get_predictions())
+    max_difference = np.max(np.abs(predictions[0] - predictions[1]))
+    sys.stderr.write("max difference of the predictions: {}\n".format(max_difference))
+    return np.allclose(predictions[0], predictions[1], rtol=1e-4, atol=1e-5)
+
+def time_iterations(model, num_iterations):
+    graph = model._build_fit_graph(iteration_number=0)
+    # c is not used by the prediction and the validation graph has its own
+    # variables, so only keep the gradients the training loss depends on
+    gradients = [gradient for gradient in tf.gradients(graph['loss'], tf.trainable_variables())
+                 if gradient is not None]
+    with tf.Session(config=model._session_config()) as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(graph['pipeline_initializer'], feed_dict=graph['pipeline_feed_dict'])
+        sess.run(graph['next_series'])
+        # the first call includes graph optimization and compilation
+        start_time = time.time()
+        sess.run([graph['loss'], gradients])
+        warmup_time = time.time() - start_time
+
+        start_time = time.time()
+        for _ in range(num_iterations):
+            sess.run([graph['loss'], gradients])
+        iteration_time = (time.time() - start_time) / num_iterations
+
+    return warmup_time, iteration_time
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        series_length = int(sys.argv[1])
+    else:
+        series_length = SERIES_LENGTH
+
+    xs, ys = make_series(series_length, NUM_EXOGENOUS_SERIES)
+    models = {compiled: TensorHIP(xs, ys, compiled=compiled) for compiled in [False, True]}
+    if not check_predictions([models[False], models[True]]):
+        print("the compiled mode gives different predictions")
+        sys.exit(1)
+    print("XLA compilation: {}".format(models[True].xla_compiled))
+
+    results = {}
+    for compiled in [False, True]:
+        model = models[compiled]
+        results[compiled] = time_iterations(model, NUM_ITERATIONS)
+        sys.stderr.write("compiled={}: first call {:.3f}s, {:.2f}ms per iteration\n".format(
+            compiled, results[compiled][0], results[compiled][1] * 1000))
+
+    print("series length: {}".format(series_length))
+    print("speedup per iteration: {:.2f}x".format(results[False][1] / results[True][1]))
@@ -0,0 +1,61 @@
+import subprocess
+import sys
+
+# Guard the import cost of the model core. `from hip.models import TensorHIP`
+# should only add the numeric dependencies on top of tensorflow itself, the
+# plotting, DataFrame and debug modules are loaded on first use. Both imports
+# are timed in bare interpreters. Exits with a non-zero status when the core
+# pulls in one of the lazy modules that a bare tensorflow import does not load,
+# or when its import time exceeds the one of tensorflow by more than the
+# threshold (in seconds). Lazy modules loaded by tensorflow itself are reported
+# but cannot fail the check.
+MAX_IMPORT_OVERHEAD = 0.5
+NUM_REPEATS = 3
+LAZY_MODULES = ['matplotlib', 'pandas', 'tqdm', 'tensorflow.python.debug']
+
+IMPORT_SCRIPT = """
+import sys
+import time
+start_time = time.time()
+{}
+print(time.time() - start_time)
+print(' '.join(name for name in {} if name in sys.modules))
+"""
+
+def measure_import(statement, num_repeats=NUM_REPEATS):
+    """
+        Fastest import time of statement over num_repeats fresh interpreters,
+        so nothing is cached in sys.modules, and the lazy modules it loads
+    """
+    import_times = []
+    for _ in range(num_repeats):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT.format(statement, LAZY_MODULES)])
+        # the last two lines, the module line is empty when none is loaded
+        import_time, loaded_modules = output.decode().split('\n')[-3:-1]
+        import_times.append(float(import_time))
+    return min(import_times), set(loaded_modules.split())
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        max_import_overhead = float(sys.argv[1])
+    else:
+        max_import_overhead = MAX_IMPORT_OVERHEAD
+
+    tensorflow_time, tensorflow_modules = measure_import('import tensorflow')
+    hip_time, hip_modules = measure_import('from hip.models import TensorHIP')
+    print("tensorflow import: {:.3f}s".format(tensorflow_time))
+    print("hip.models import: {:.3f}s ({:+.3f}s over tensorflow)".format(hip_time, hip_time - tensorflow_time))
+
+    if len(tensorflow_modules) > 0:
+        print("loaded by tensorflow itself, not checked: {}".format(', '.join(sorted(tensorflow_modules))))
+
+    eager_modules = hip_modules - tensorflow_modules
+    failed = False
+    if len(eager_modules) > 0:
+        print("modules that should be loaded lazily: {}".format(', '.join(sorted(eager_modules))))
+        failed = True
+    if hip_time - tensorflow_time > max_import_overhead:
+        print("import overhead is above {:.3f}s".format(max_import_overhead))
+        failed = True
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from hip.distributed import AUTHKEY_ENVIRONMENT_VARIABLE, shutdown_worker
+from hip.models import MEMORY_WINDOW, TensorHIP
+
+# Fit the joint shared-parameter objective of `train_sharded` in a single
+# process and sharded across NUM_WORKERS worker processes on this machine.
+# Exits with a non-zero status when the fitted parameters differ by more than
+# the tolerances, which only allow for the different summation order.
+NUM_WORKERS = 3
+NUM_SERIES = 12
+SERIES_LENGTH = 300
+BASE_PORT = 6100
+RELATIVE_TOLERANCE = 1e-4
+ABSOLUTE_TOLERANCE = 1e-5
+
+def make_series(seed=0, eta=0.5, mu=(1.0, 0.5), theta=1.0, C=1.0, noise=0.1):
+    """
+        Simulate the target series from the HIP model itself, so the fit has
+        a single well-defined optimum both runs have to converge to
+    """
+    random_state = np.random.RandomState(seed)
+    xs = random_state.poisson(5, size=(NUM_SERIES, 2, SERIES_LENGTH)).astype(float)
+    kernel = (np.arange(MEMORY_WINDOW, 0, -1) + 1 + 0.01) ** (-1 - theta)
+    ys = []
+    for x in xs:
+        y = np.zeros(MEMORY_WINDOW + SERIES_LENGTH)
+        for t in range(SERIES_LENGTH):
+            history = y[t:t + MEMORY_WINDOW]
+            y[t + MEMORY_WINDOW] = (eta + np.dot(mu, x[:, t]) + C * np.dot(history, kernel) +
+                                    noise * random_state.randn())
+        ys.append(y[MEMORY_WINDOW:])
+    return xs, ys
+
+def make_model(xs, ys):
+    return TensorHIP(xs, ys, scale_series=False, num_initializations=2, max_iterations=500)
+
+if __name__ == '__main__':
+    addresses = [('localhost', BASE_PORT + i) for i in range(NUM_WORKERS)]
+    authkey = os.urandom(16).hex()
+    worker_environment = dict(os.environ)
+    worker_environment[AUTHKEY_ENVIRONMENT_VARIABLE] = authkey
+    workers = [
+        subprocess.Popen([sys.executable, '-m', 'hip.distributed', '{}:{}'.format(*address)],
+                         env=worker_environment)
+        for address in addresses
+    ]
+    try:
+        xs, ys = make_series()
+
+        single_process_model = make_model(xs, ys)
+        single_process_model.train_sharded()
+
+        sharded_model = make_model(xs, ys)
+        sharded_model.train_sharded(worker_addresses=addresses, authkey=authkey)
+    finally:
+        for address in addresses:
+            shutdown_worker(address, authkey)
+        for worker in workers:
+            worker.wait()
+
+    single_process_params = single_process_model.get_model_parameters()
+    sharded_params = sharded_model.get_model_parameters()
+    print("single process: {}".format(single_process_params))
+    print("{} workers:      {}".format(NUM_WORKERS, sharded_params))
+    matching = True
+    for key in ['eta', 'theta', 'C', 'mu']:
+        print("max difference of {}: {}".format(
+            key, np.max(np.abs(single_process_params[key] - sharded_params[key]))))
+        matching = matching and np.allclose(
+                                            sharded_params[key],
+                                            single_process_params[key],
+                                            rtol=RELATIVE_TOLERANCE,
+                                            atol=ABSOLUTE_TOLERANCE
+                                           )
+    if not matching:
+        print("sharded fit does not match the single process fit")
+        sys.exit(1)
@@ -0,0 +1,409 @@
+"""
+    Data-parallel fitting of a TensorHIP model with one parameter set shared
+    by all the target series. The series are split into shards, each worker
+    process evaluates the loss and gradient of its shard and the coordinator
+    sums them up for every L-BFGS step.
+
+    Workers listen on a socket and can run on other hosts. Messages are
+    pickled, so the connections are authenticated with a shared secret key
+    that every worker and the coordinator have to be given explicitly:
+
+        HIP_AUTHKEY=<secret> python -m hip.distributed localhost:6000
+
+    and the coordinator fits the model with
+
+        model.train_sharded(worker_addresses=[('localhost', 6000), ...], authkey=<secret>)
+
+    The objective is the sum of the per-series losses, minimized jointly.
+    This is not the objective of `TensorHIP.train`, which minimizes the loss
+    of one series after the other, so the two generally give different
+    parameters. Without worker addresses the whole corpus is evaluated as a
+    single shard in the coordinator process, which is the single-process
+    reference the sharded fit reproduces.
+"""
+import logging
+import os
+import sys
+import time
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+import tensorflow as tf
+from scipy.optimize import minimize
+
+from hip.models import PARAMS_LOWER_BOUNDS, RANDOM_SEED, TensorHIP
+
+# environment variable holding the authentication key of a worker started from the command line
+AUTHKEY_ENVIRONMENT_VARIABLE = 'HIP_AUTHKEY'
+# order of the scalar parameters in the flat parameter vector,
+# followed by the exogenous weights mu
+SCALAR_PARAMS = ['eta', 'theta', 'C']
+
+def check_authkey(authkey):
+    """
+        Anyone who can authenticate to a worker can run arbitrary code in it
+        through pickle, so there is no default key
+    """
+    if authkey is None or len(authkey) == 0:
+        raise ValueError("An authentication key shared by the workers and the coordinator is required")
+    if isinstance(authkey, str):
+        authkey = authkey.encode()
+    return authkey
+
+def unpack_params(flat_params, fixed_params, num_of_exogenous_series):
+    """
+        Split the flat parameter vector optimized by L-BFGS into the model
+        parameters. Works with both NumPy arrays and tensors.
+    """
+    params = dict()
+    offset = 0
+    for key in SCALAR_PARAMS:
+        if key in fixed_params:
+            params[key] = fixed_params[key]
+        else:
+            params[key] = flat_params[offset]
+            offset += 1
+    params['mu'] = flat_params[np.newaxis, offset:offset + num_of_exogenous_series]
+    return params
+
+class ShardEvaluator():
+    """
+        Loss and gradient of the shared-parameter model on a shard of the
+        target series. The series are already scaled by the coordinator.
+        Evaluated in float64, so the rounding of the float32 model does not
+        steer L-BFGS-B differently depending on how the series are sharded.
+    """
+    def __init__(self, config, xs, ys):
+        self.model = TensorHIP(
+                               xs, ys,
+                               train_split_size=config['train_split_size'],
+                               scale_series=False,
+                               compiled=config['compiled']
+                              )
+        model = self.model
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.flat_params = tf.placeholder(tf.float64, shape=(config['num_params'],), name='flat_params')
+            params = unpack_params(self.flat_params, config['fixed_params'], config['num_of_exogenous_series'])
+
+            # stage the shard once, the optimization only feeds the parameters
+            ys_staged = tf.placeholder(tf.float64, shape=model.ys.shape)
+            ys_series = tf.Variable(ys_staged, trainable=False)
+            feed_dict = {ys_staged: model.ys}
+            dense_exogenous = config['num_of_exogenous_series'] > 0 and model.sparse_input is False
+            if dense_exogenous is True:
+                xs_staged = tf.placeholder(tf.float64, shape=model.x.shape)
+                xs_series = tf.Variable(xs_staged, trainable=False)
+                feed_dict[xs_staged] = model.x
+
+            with model._jit_scope():
+                if dense_exogenous is True:
+                    exogenous = tf.tensordot(xs_series, params['mu'][0], axes=[[1], [0]])
+                elif model.sparse_input is True:
+                    exogenous = tf.stack([
+                        model._exogenous_contribution(self._sparse_constant(x), params['mu'])
+                        for x in model.x
+                    ])
+                else:
+                    exogenous = tf.zeros_like(ys_series)
+
+                pred = model._predict_batch(exogenous[:, :model.num_cv_train], params)
+                self.loss = tf.reduce_sum(tf.sqrt(tf.reduce_sum(
+                    tf.square(ys_series[:, :model.num_cv_train] - pred), axis=1)))
+                self.gradient = tf.gradients(self.loss, self.flat_params)[0]
+
+                validation_pred = model._predict_batch(exogenous[:, model.num_cv_train:model.num_train], params)
+                self.validation_loss_sum = tf.reduce_sum(tf.sqrt(tf.reduce_sum(
+                    tf.square(ys_series[:, model.num_cv_train:model.num_train] - validation_pred), axis=1)))
+
+            self.session = tf.Session(graph=self.graph, config=model._session_config())
+            self.session.run(tf.global_variables_initializer(), feed_dict=feed_dict)
+
+    def _sparse_constant(self, x):
+        x = x.tocoo()
+        return tf.SparseTensor(
+                               indices=np.column_stack([x.row, x.col]).astype(np.int64),
+                               values=x.data.astype(np.float64),
+                               dense_shape=x.shape
+                              )
+
+    def loss_and_gradient(self, flat_params):
+        return tuple(self.session.run([self.loss, self.gradient], feed_dict={self.flat_params: flat_params}))
+
+    def validation_loss(self, flat_params):
+        return self.session.run(self.validation_loss_sum, feed_dict={self.flat_params: flat_params})
+
+    def close(self):
+        self.session.close()
+
+class ShardHandler():
+    """
+        Execute the messages sent by the coordinator for one shard and
+        build the replies. Errors are sent back instead of raised so the
+        coordinator can report them.
+    """
+    def __init__(self):
+        self.evaluator = None
+
+    def handle(self, message):
+        command = message[0]
+        try:
+            if command == 'load':
+                self.close()
+                self.evaluator = ShardEvaluator(*message[1:])
+                return ('ok',)
+            elif command == 'evaluate':
+                return ('ok',) + self.evaluator.loss_and_gradient(message[1])
+            elif command == 'validate':
+                return ('ok', self.evaluator.validation_loss(message[1]))
+            else:
+                raise ValueError("Unknown command {}".format(command))
+        except Exception:
+            return ('error', traceback.format_exc())
+
+    def close(self):
+        if self.evaluator is not None:
+            self.evaluator.close()
+            self.evaluator = None
+
+def unwrap_reply(reply):
+    if reply[0] == 'error':
+        raise RuntimeError("Shard evaluation failed:\n" + reply[1])
+    return reply[1:]
+
+class LocalShard():
+    """
+        Shard evaluated in the coordinator process
+    """
+    def __init__(self):
+        self.handler = ShardHandler()
+        self.reply = None
+
+    def send(self, message):
+        self.reply = self.handler.handle(message)
+
+    def receive(self):
+        return unwrap_reply(self.reply)
+
+    def close(self):
+        self.handler.close()
+
+class RemoteShard():
+    """
+        Shard evaluated by a worker process listening on address
+    """
+    def __init__(self, address, authkey, connect_timeout=30):
+        # workers may still be starting up
+        deadline = time.time() + connect_timeout
+        while True:
+            try:
+                self.connection = Client(address, authkey=authkey)
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def send(self, message):
+        self.connection.send(message)
+
+    def receive(self):
+        return unwrap_reply(self.connection.recv())
+
+    def close(self):
+        self.connection.send(('close',))
+        self.connection.close()
+
+class ShardedTrainer():
+    """
+        Coordinator of the data-parallel fit. Splits the target series of
+        the model between the workers, runs L-BFGS-B on the summed loss and
+        gradient and stores the best parameters over the random restarts
+        in the model. Unlike `TensorHIP.train` all the series are fit
+        jointly instead of one after the other.
+    """
+    def __init__(self, model, worker_addresses=None, authkey=None):
+        self.model = model
+        self.worker_addresses = worker_addresses
+        if worker_addresses is not None:
+            authkey = check_authkey(authkey)
+        self.authkey = authkey
+
+        self.fixed_params = dict()
+        for key, fixed in zip(SCALAR_PARAMS, [model.fixed_eta, model.fixed_theta, model.fixed_C]):
+            if fixed is True:
+                self.fixed_params[key] = np.float64(model.model_params[key])
+        self.trained_params = [key for key in SCALAR_PARAMS if key not in self.fixed_params]
+        self.num_params = len(self.trained_params) + model.num_of_exogenous_series
+        self.shards = []
+
+    def train(self):
+        model = self.model
+        try:
+            self.connect()
+            best_validation_loss = np.inf
+            best_flat_params = None
+            for i in range(model.num_initializations):
+                model.print_log("== Initialization " + str(i + 1))
+                result = minimize(
+                                  self.loss_and_gradient,
+                                  self.initial_params(RANDOM_SEED + i),
+                                  jac=True,
+                                  method='L-BFGS-B',
+                                  bounds=self.bounds(),
+                                  options={'maxiter': model.max_iterations}
+                                 )
+                validation_loss = self.validation_loss(result.x)
+                if validation_loss < best_validation_loss or best_flat_params is None:
+                    best_validation_loss = validation_loss
+                    best_flat_params = result.x
+        finally:
+            self.close()
+
+        params = unpack_params(best_flat_params.astype(np.float32), self.fixed_params, model.num_of_exogenous_series)
+        model.validation_loss = best_validation_loss
+        for key in self.trained_params + ['mu']:
+            model.model_params[key] = params[key]
+
+    def connect(self):
+        model = self.model
+        if self.worker_addresses is None:
+            shards = [LocalShard()]
+        else:
+            shards = [RemoteShard(address, self.authkey) for address in self.worker_addresses]
+
+        config = {
+            'train_split_size': model.train_split_size,
+            'compiled': model.compiled,
+            'fixed_params': self.fixed_params,
+            'num_params': self.num_params,
+            'num_of_exogenous_series': model.num_of_exogenous_series,
+        }
+        series_indices = np.array_split(np.arange(model.num_of_series), len(shards))
+        self.shards = []
+        for shard, indices in zip(shards, series_indices):
+            if len(indices) == 0:
+                # more workers than series
+                shard.close()
+                continue
+            if model.sparse_input is True:
+                xs = [model.x[index] for index in indices]
+            else:
+                xs = model.x[indices]
+            shard.send(('load', config, xs, model.ys[indices]))
+            self.shards.append(shard)
+        for shard in self.shards:
+            shard.receive()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        self.shards = []
+
+    def initial_params(self, random_seed):
+        """
+            Start from the current model parameters when available and from
+            the random initialization of `TensorHIP` otherwise
+        """
+        model = self.model
+        random_state = np.random.RandomState(random_seed)
+        random_params = {
+            'eta': random_state.normal(0, 0.5),
+            'theta': random_state.normal(10, 5),
+            'C': random_state.normal(3, 1),
+            'mu': random_state.normal(1, 1, size=model.num_of_exogenous_series),
+        }
+        initial_params = []
+        for key in self.trained_params + ['mu']:
+            if key in model.model_params:
+                initial_params.append(np.ravel(model.model_params[key]))
+            else:
+                initial_params.append(np.ravel(random_params[key]))
+        return np.concatenate(initial_params).astype(np.float64)
+
+    def bounds(self):
+        return ([(PARAMS_LOWER_BOUNDS[key], None) for key in self.trained_params] +
+                [(None, None)] * self.model.num_of_exogenous_series)
+
+    def regularization(self, flat_params):
+        mu = flat_params[len(self.trained_params):]
+        loss = self.model.l1_param * np.sum(np.abs(mu)) + self.model.l2_param * np.sum(np.square(mu))
+        gradient = np.zeros_like(flat_params)
+        gradient[len(self.trained_params):] = self.model.l1_param * np.sign(mu) + 2 * self.model.l2_param * mu
+        return loss, gradient
+
+    def loss_and_gradient(self, flat_params):
+        # send to all the shards first so they evaluate in parallel
+        for shard in self.shards:
+            shard.send(('evaluate', flat_params))
+        loss, gradient = self.regularization(flat_params)
+        for shard in self.shards:
+            shard_loss, shard_gradient = shard.receive()
+            loss += shard_loss
+            gradient += shard_gradient
+        return loss, gradient
+
+    def validation_loss(self, flat_params):
+        """
+            Mean validation loss over the series plus the regularization,
+            matching the validation loss of `TensorHIP.train`
+        """
+        for shard in self.shards:
+            shard.send(('validate', flat_params))
+        validation_loss_sum = sum(shard.receive()[0] for shard in self.shards)
+        return validation_loss_sum / self.model.num_of_series + self.regularization(flat_params)[0]
+
+def run_worker(address, authkey):
+    """
+        Serve shard evaluations on address, one coordinator at a time,
+        until a coordinator sends a shutdown message
+    """
+    authkey = check_authkey(authkey)
+    listener = Listener(address, authkey=authkey)
+    logging.info("Worker listening on {}".format(listener.address))
+    running = True
+    while running:
+        # a failed handshake or a dropped coordinator only ends that
+        # connection, the worker keeps serving until told to shut down
+        try:
+            connection = listener.accept()
+        except (AuthenticationError, EOFError, OSError) as error:
+            logging.warning("Rejected a connection: {!r}".format(error))
+            continue
+        handler = ShardHandler()
+        try:
+            while True:
+                message = connection.recv()
+                if message[0] == 'close':
+                    break
+                if message[0] == 'shutdown':
+                    running = False
+                    break
+                connection.send(handler.handle(message))
+        except (AuthenticationError, EOFError, OSError) as error:
+            logging.warning("Lost the connection to the coordinator: {!r}".format(error))
+        finally:
+            handler.close()
+            connection.close()
+    listener.close()
+
+def shutdown_worker(address, authkey):
+    authkey = check_authkey(authkey)
+    connection = Client(address, authkey=authkey)
+    connection.send(('shutdown',))
+    connection.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        host, port = sys.argv[1].rsplit(':', 1)
+    else:
+        raise SyntaxError("Insufficient arguments")
+    # read from the environment so the key does not show up in the process list
+    authkey = os.environ.get(AUTHKEY_ENVIRONMENT_VARIABLE)
+    if authkey is None:
+        raise SyntaxError("Set the authentication key in {}".format(AUTHKEY_ENVIRONMENT_VARIABLE))
+
+    logging.basicConfig(level=logging.INFO)
+    run_worker((host, int(port)), authkey=authkey)
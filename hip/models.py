@@ -1,10 +1,7 @@
 import logging
 import tensorflow as tf
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-from tensorflow.python import debug as tf_debug
-from tqdm import tqdm
+from scipy import sparse
 
 from hip.utils import TimeSeriesScaler
 
@@ -12,6 +9,19 @@ RANDOM_SEED = 42
 # select the past MEMORY_WINDOW values of prediction when 
 # calculating the endogenous influence
 MEMORY_WINDOW = 7
+def xla_cpu_available():
+    """
+        Whether this tensorflow build registers an XLA_CPU device, without
+        which the ops marked for compilation run uncompiled
+    """
+    from tensorflow.python.client import device_lib
+    return any(device.device_type == 'XLA_CPU' for device in device_lib.list_local_devices())
+
+# maximum number of proximal gradient steps on mu after each L-BFGS fit
+# when an l1 penalty is set
+PROXIMAL_ITERATIONS = 50
+# lower bounds matching the constraints of the model variables
+PARAMS_LOWER_BOUNDS = {'eta': None, 'theta': 0.5, 'C': 0.01}
 class TensorHIP():
     """
         Hawkes Intensity Process Model Implemented and Optimized in TensorFlow
@@ -35,10 +45,19 @@ class TensorHIP():
                  scale_series=True,
                  verbose=False,
                  optimizer='l-bfgs',
-                 feature_names=None
+                 feature_names=None,
+                 compiled=False,
+                 screening=False,
+                 screening_tolerance=1e-4
         ):
         self.num_of_series = len(ys)
-        self.x = np.asarray(xs).astype(float)
+        # exogenous series can be given as one scipy sparse matrix
+        # (num_of_exogenous_series x series_length) per target series
+        self.sparse_input = len(xs) > 0 and sparse.issparse(xs[0])
+        if self.sparse_input is True:
+            self.x = [sparse.csr_matrix(x, dtype=float) for x in xs]
+        else:
+            self.x = np.asarray(xs).astype(float)
         # store train-validation-test split points 
         self.train_split_size = train_split_size
                 
@@ -56,19 +75,17 @@ class TensorHIP():
             # define the exogenous data as a vector of zeros with appropriate shape
             self.x = np.asarray([np.zeros_like(self.y)])
             self.num_of_exogenous_series = 0
-        self.series_length = self.y[0].shape[0]
-
-        self.num_train = int(self.series_length * train_split_size)
-        self.num_cv_train = int(self.num_train * 0.8)
-        self.num_cv_test = self.num_train - self.num_cv_train
-        self.num_test = self.series_length - self.num_train
+        self._set_split_points()
         
         self.validation_loss = np.inf
 
         self.scale_series = scale_series
         if scale_series is True:
             self.series_scaler = TimeSeriesScaler()
-            self.x = self.series_scaler.transform_xs(self.x)
+            if self.sparse_input is True:
+                self.x = self.series_scaler.transform_sparse_xs(self.x)
+            else:
+                self.x = self.series_scaler.transform_xs(self.x)
             self.ys = self.series_scaler.transform_ys(self.y)
         else:
             self.ys = self.y
@@ -88,17 +105,17 @@ class TensorHIP():
             self.fixed_C = True
             self.model_params['C'] = fix_C_param_value
         self.fixed_eta = False
+        self.eta_param_mode = eta_param_mode
         if eta_param_mode != "random":
             self.fixed_eta = True
-            if eta_param_mode == 'exo_mean':
-                self.model_params['eta'] = np.mean(self.x, dtype=np.float32)
-            elif eta_param_mode == 'target_mean':
-                self.model_params['eta'] = np.mean(self.ys, dtype=np.float32)
+            if eta_param_mode in ['exo_mean', 'target_mean']:
+                self._set_series_mean_eta()
             elif eta_param_mode == 'constant':
                 self.model_params['eta'] = fix_eta_param_value
             else:
                 self.print_log("Invalid eta initialization mode. reverting to random.")
                 self.fixed_eta = False
+                self.eta_param_mode = 'random'
                 
         self.l1_param = l1_param
         self.l2_param = l2_param
@@ -112,10 +129,52 @@ class TensorHIP():
 
         self.feature_names = feature_names
         self.optimizer = optimizer
+        # build static-shape graphs and compile them with XLA where the
+        # tensorflow build supports it
+        self.compiled = compiled
+        self.xla_compiled = False
+        if compiled is True:
+            self.xla_compiled = xla_cpu_available()
+            if self.xla_compiled is True:
+                self.print_log("Compiling the model graphs with XLA")
+            else:
+                logging.warning("This tensorflow build has no XLA_CPU device. The compiled mode "
+                                "only uses the static-shape recursion, nothing is compiled.")
+        # drop the exogenous series whose weight is shrunk to zero by the
+        # l1 penalty from the following initializations
+        self.screening = screening
+        self.screening_tolerance = screening_tolerance
+        # indices of the exogenous series used in fitting. None means all
+        self.active_features = None
+        # float32 copies of the series fed to the input pipelines
+        self._staged_series = dict()
+
+    def _set_series_mean_eta(self):
+        """
+            Fix eta to the mean of the scaled exogenous ('exo_mean') or
+            target ('target_mean') series
+        """
+        if self.eta_param_mode == 'exo_mean':
+            if self.sparse_input is True:
+                exo_sum = sum(x.sum() for x in self.x)
+                exo_size = sum(x.shape[0] * x.shape[1] for x in self.x)
+                self.model_params['eta'] = np.float32(exo_sum / exo_size)
+            else:
+                self.model_params['eta'] = np.mean(self.x, dtype=np.float32)
+        elif self.eta_param_mode == 'target_mean':
+            self.model_params['eta'] = np.mean(self.ys, dtype=np.float32)
 
     def print_log(self, msg):    
         logging.info(msg)
 
+    def _set_split_points(self):
+        self.series_length = self.y[0].shape[0]
+
+        self.num_train = int(self.series_length * self.train_split_size)
+        self.num_cv_train = int(self.num_train * 0.8)
+        self.num_cv_test = self.num_train - self.num_cv_train
+        self.num_test = self.series_length - self.num_train
+
     def time_decay_base(self, i):
         """
             Kernel Base for the time-decaying exponential kernel
@@ -140,19 +199,22 @@ class TensorHIP():
             ----------
             x
                 a list of the previous values of the relative sources of influence.
+                Either a dense tensor or a SparseTensor.
             mode_params
                  model parameters.
         """
         if model_params is None:
             model_params = self.model_params
 
+        exogenous = self._exogenous_contribution(x, model_params['mu'])
+        if self.compiled is True:
+            return self._predict_static(exogenous, model_params)
+
         predictions = tf.Variable([])
         i = tf.constant(0)
-        train_size = tf.shape(x)[1]
+        train_size = tf.shape(exogenous)[0]
         bias = model_params['eta']
-        def loop_body(i, x, pred_history):
-            exogenous = tf.reduce_sum(tf.multiply(model_params['mu'], x[:, i]))
-            
+        def loop_body(i, pred_history):
             endo_history_window_start = tf.maximum(0, i - MEMORY_WINDOW)
             endo_history = pred_history[endo_history_window_start:]
             endogenous = model_params['C'] * tf.reduce_sum(endo_history *
@@ -161,21 +223,164 @@ class TensorHIP():
                                                         )
             tf.Print(endo_history_window_start, [endo_history_window_start])
             new_prediction = tf.add_n([bias
-                                       , exogenous
+                                       , exogenous[i]
                                        , endogenous]) 
             pred_history = tf.concat([pred_history, [new_prediction]], axis=0)
             i = tf.add(i, 1)
-            return [i, x, pred_history]
+            return [i, pred_history]
 
-        loop_condition = lambda i, x, pred_history: tf.less(i, train_size)
+        loop_condition = lambda i, pred_history: tf.less(i, train_size)
 
-        _, _, predictions = tf.while_loop(
-                                          cond=loop_condition, 
-                                          body=loop_body,
-                                          loop_vars=[i, x, predictions], 
-                                          shape_invariants=[i.get_shape(), x.get_shape(), tf.TensorShape(None)]
-                                         )
+        _, predictions = tf.while_loop(
+                                       cond=loop_condition, 
+                                       body=loop_body,
+                                       loop_vars=[i, predictions], 
+                                       shape_invariants=[i.get_shape(), tf.TensorShape(None)]
+                                      )
         return predictions
+
+    def _exogenous_contribution(self, x, mu):
+        """
+            Exogenous influence at every time step of the series, computed
+            for the whole series at once instead of inside the recursion
+
+            Parameters
+            ----------
+            x
+                dense tensor or SparseTensor of shape
+                (num_of_exogenous_series, series_length)
+            mu
+                exogenous weights of shape (1, num_of_exogenous_series)
+        """
+        if isinstance(x, tf.SparseTensor):
+            # XLA has no kernels for the sparse ops, keep them out of the cluster
+            with tf.contrib.compiler.jit.experimental_jit_scope(compile_ops=False):
+                exogenous = tf.sparse_tensor_dense_matmul(x, mu, adjoint_a=True, adjoint_b=True)
+            return tf.reshape(exogenous, [-1])
+        return tf.reduce_sum(mu * tf.transpose(x), axis=1)
+
+    def _predict_static(self, exogenous, model_params):
+        """
+            Static-shape variant of `predict` used in compiled mode.
+            The endogenous history is kept in a fixed buffer of the last
+            MEMORY_WINDOW predictions (zero-padded at the start of the series)
+            so every loop variable has a known shape and XLA, where
+            available, can compile the whole recursion.
+        """
+        # the decay base of a prediction made `lag` steps ago is lag + 1,
+        # the window is ordered from the oldest to the most recent value
+        lags = tf.cast(tf.range(MEMORY_WINDOW, 0, -1), tf.float32)
+        kernel = tf.pow(lags + 1 + tf.constant(0.01), -1 - model_params['theta'])
+
+        def step(state, exogenous_value):
+            history, _ = state
+            endogenous = model_params['C'] * tf.reduce_sum(history * kernel)
+            new_prediction = model_params['eta'] + exogenous_value + endogenous
+            history = tf.concat([history[1:], [new_prediction]], axis=0)
+            return history, new_prediction
+
+        _, predictions = tf.scan(
+                                 step,
+                                 exogenous,
+                                 initializer=(tf.zeros([MEMORY_WINDOW]), tf.constant(0.))
+                                )
+        return predictions
+
+    def _jit_scope(self):
+        """
+            Scope marking the ops built inside it for XLA compilation
+            when the model runs in compiled mode
+        """
+        return tf.contrib.compiler.jit.experimental_jit_scope(compile_ops=self.xla_compiled)
+
+    def _session_config(self):
+        # the global jit level only clusters GPU ops in TF 1.x, the ops on
+        # the CPU are compiled through the jit scope
+        return tf.ConfigProto()
+
+    def _series_placeholder(self, name, length, exogenous=True, dtype=tf.float32):
+        """
+            Placeholder for a slice of a series. In compiled mode the shape
+            is fully static so the compiler can specialize the graph on it.
+        """
+        shape = None
+        if self.compiled is True:
+            if exogenous is True:
+                shape = (self._series_x(0).shape[0], length)
+            else:
+                shape = (length,)
+        if exogenous is True and self.sparse_input is True:
+            return tf.sparse_placeholder(dtype, shape=shape, name=name)
+        return tf.placeholder(dtype, shape=shape, name=name)
+
+    def _series_x(self, index):
+        """
+            Exogenous series of a target series restricted to the
+            active features
+        """
+        if self.active_features is None:
+            return self.x[index]
+        return self.x[index][self.active_features]
+
+    def _prediction_x(self, index):
+        """
+            Exogenous series of a target series as used for predictions.
+            The scaling covers all the features, as in training, before
+            the series is restricted to the active features.
+        """
+        x = self.x[index]
+        if self.scale_series is True:
+            x = self.series_scaler.transform_x(x)
+        if self.active_features is None:
+            return x
+        return x[self.active_features]
+
+    def _feed_value(self, x):
+        """
+            Convert a slice of the exogenous series to a value that can be
+            fed to the placeholders created by `_series_placeholder`
+        """
+        if self.sparse_input is True:
+            x = x.tocoo()
+            return tf.SparseTensorValue(
+                                        indices=np.column_stack([x.row, x.col]),
+                                        values=x.data.astype(np.float32),
+                                        dense_shape=x.shape
+                                       )
+        return x
+
+    def _num_active_features(self):
+        if self.active_features is None:
+            return self.num_of_exogenous_series
+        return len(self.active_features)
+
+    def _screen_features(self, mu):
+        """
+            Restrict the following fits to the exogenous series with a
+            non-zero weight in `mu`
+        """
+        self.active_features = np.flatnonzero(np.abs(mu[0]) > self.screening_tolerance)
+        self._staged_series = dict()
+        self.print_log("Screening kept {} of {} exogenous series".format(
+            len(self.active_features), self.num_of_exogenous_series))
+
+    def _expand_mu(self, mu):
+        """
+            Scatter the weights of the active features back to a full
+            (1, num_of_exogenous_series) weight vector
+        """
+        if self.active_features is None:
+            return mu
+        full_mu = np.zeros((1, self.num_of_exogenous_series), dtype=mu.dtype)
+        full_mu[:, self.active_features] = mu
+        return full_mu
+
+    def _loss(self, y_truth, pred, mu):
+        return (
+            tf.sqrt(tf.reduce_sum(tf.square(y_truth - pred))) + 
+            self.l1_param * (tf.reduce_sum(tf.abs(mu))) + 
+            self.l2_param * (tf.reduce_sum(tf.square(mu)))
+        )
             
     def train(self):
         """
@@ -184,101 +389,335 @@ class TensorHIP():
         """ 
         best_validation_loss = self.validation_loss       
         best_model_params = None
+        self.active_features = None
+        self._staged_series = dict()
         for i in range(self.num_initializations):
             self.print_log("== Initialization " + str(i + 1))
             loss_value, model_params = self._fit(iteration_number=i)
             if loss_value < best_validation_loss or best_model_params == None:
                 best_validation_loss = loss_value
                 best_model_params = model_params
+            if self.screening is True:
+                self._screen_features(best_model_params['mu'])
+                # the following fits and the predictions leave out the
+                # dropped series, so their stored weights have to be zero
+                best_model_params['mu'] = self._expand_mu(best_model_params['mu'][:, self.active_features])
         self.validation_loss = best_validation_loss
         self.model_params = best_model_params
+
+    def update(self, new_xs, new_ys, max_iterations=10, degradation_tolerance=0.1):
+        """
+            Append new observations to the target series and refit the model
+            with a single short optimization warm-started from the current
+            parameters. Falls back to a full `train` with random restarts
+            when the model has not been trained yet or when the validation
+            loss of the warm fit degrades.
+
+            Parameters
+            ----------
+            new_xs
+                new values of the exogenous series, one
+                (num_of_exogenous_series x num_new_values) array or sparse
+                matrix per target series
+            new_ys
+                new values of the target series
+            max_iterations
+                maximum number of L-BFGS iterations of the warm fit
+            degradation_tolerance
+                relative increase of the validation loss over the one of
+                the previous parameters on the new data that triggers the
+                full retraining
+        """
+        self._extend_series(new_xs, new_ys)
+
+        if 'mu' not in self.model_params:
+            self.print_log("Model is not trained. Running a full training.")
+            self.train()
+            return
+
+        # the stored validation loss belongs to the previous window and
+        # scale, so the previous parameters are evaluated on the new ones
+        previous_validation_loss, _ = self._fit(iteration_number=0, max_iterations=0)
+        loss_value, model_params = self._fit(iteration_number=0, max_iterations=max_iterations)
+        if loss_value > previous_validation_loss * (1 + degradation_tolerance):
+            self.print_log("Warm fit degraded the validation loss from {} to {}. Running a full training.".format(
+                previous_validation_loss, loss_value))
+            self._reset_model_params()
+            self.validation_loss = np.inf
+            self.train()
+        else:
+            self.validation_loss = loss_value
+            self.model_params = model_params
+
+    def train_sharded(self, worker_addresses=None, authkey=None):
+        """
+            Fit one parameter set shared by all the target series with the
+            series split between the workers listening on worker_addresses.
+            The losses of all the series are minimized jointly, which is a
+            different objective from `train`, where the series are fit one
+            after the other, so the parameters generally differ from `train`.
+            authkey is the secret key the workers were started with and is
+            required with worker_addresses. See `hip.distributed` for
+            running the workers.
+        """
+        from hip.distributed import ShardedTrainer
+        ShardedTrainer(self, worker_addresses=worker_addresses, authkey=authkey).train()
+
+    def _extend_series(self, new_xs, new_ys):
+        """
+            Append new observations to the stored series and rescale them
+            together with the existing values
+        """
+        self.y = np.concatenate([self.y, np.asarray(new_ys).astype(float)], axis=1)
+
+        if self.num_of_exogenous_series == 0:
+            x = np.asarray([np.zeros_like(self.y)])
+        else:
+            x = self.x
+            if self.scale_series is True:
+                x = self.series_scaler.invert_transform_xs(x)
+            if self.sparse_input is True:
+                x = [sparse.hstack([x_series, new_x_series], format='csr', dtype=float)
+                     for x_series, new_x_series in zip(x, new_xs)]
+            else:
+                x = np.concatenate([x, np.asarray(new_xs).astype(float)], axis=2)
+
+        if self.scale_series is True:
+            if self.sparse_input is True:
+                self.x = self.series_scaler.transform_sparse_xs(x)
+            elif self.num_of_exogenous_series > 0:
+                self.x = self.series_scaler.transform_xs(x)
+            else:
+                self.x = x
+            self.ys = self.series_scaler.transform_ys(self.y)
+        else:
+            self.x = x
+            self.ys = self.y
+
+        # an eta derived from the series has to follow their new values and scale
+        self._set_series_mean_eta()
+        self._staged_series = dict()
+        self._set_split_points()
+
+    def _reset_model_params(self):
+        """
+            Drop the fitted parameters and keep the fixed ones
+        """
+        fixed_params = {
+            'eta': self.fixed_eta,
+            'theta': self.fixed_theta,
+            'C': self.fixed_C,
+            'c': self.fixed_c,
+        }
+        self.model_params = {key: value for key, value in self.model_params.items()
+                             if fixed_params.get(key, False) is True}
         
-    def _fit(self, iteration_number):
+    def _fit(self, iteration_number, max_iterations=None):
         """
             Internal method for fitting the model at each iteration of the
-            training process
+            training process. With max_iterations=0 the current parameters
+            are only evaluated on the validation window.
         """
-        tf.reset_default_graph()
-        x_observed = tf.placeholder(tf.float32, name='x_observed')
-        y_truth = tf.placeholder(tf.float32, name='y_truth')
-
-        # create params dictionary for easier management
+        if max_iterations is None:
+            max_iterations = self.max_iterations
+        graph = self._build_fit_graph(iteration_number)
+        params = graph['params']
         params_keys = ['eta', 'mu', 'theta', 'C', 'c']
-        params = self._init_tf_model_variables(random_seed=RANDOM_SEED + iteration_number)
-        eta = params['eta']
-        mu = params['mu']
-        theta = params['theta']
-        C = params['C']
-        c = params['c']
-        pred = self.predict(x_observed, params)
-        loss = (
-            tf.sqrt(tf.reduce_sum(tf.square(y_truth - pred))) + 
-            self.l1_param * (tf.reduce_sum(tf.abs(mu))) + 
-            self.l2_param * (tf.reduce_sum(tf.square(mu)))
-        ) 
-        previous_loss = np.inf
+        params_tensors = [params[key] for key in params_keys]
         optimizer = tf.contrib.opt.ScipyOptimizerInterface(
-                                                            loss, 
+                                                            graph['loss'], 
                                                             method='L-BFGS-B',
-                                                            options={'maxiter': self.max_iterations}
+                                                            options={'maxiter': max_iterations}
                                                         )            
         
         validation_loss_sum = 0 
         self.losses = []
-        with tf.Session() as sess:
+        with tf.Session(config=self._session_config()) as sess:
             tf.set_random_seed(RANDOM_SEED)
             sess.run(tf.global_variables_initializer())
             
-            params_vals = sess.run([eta, mu, theta, C, c])
-            fitted_model_params = dict(zip(params_keys, params_vals)) 
-            xs = self.x 
+            if self.sparse_input is False:
+                sess.run(graph['pipeline_initializer'], feed_dict=graph['pipeline_feed_dict'])
+            
             ys = self.ys            
             for i in range(self.num_of_series):
                 self.print_log("--- Fitting target series #{}".format(i + 1))
-                x = xs[i]
-                y = ys[i]
-                test_split = int(len(y) * self.train_split_size)
-                validation_split = int(test_split * self.train_split_size)
-                train_x, train_y = x[:, :self.num_cv_train], y[:self.num_cv_train]
-                validation_x, validation_y = x[:, self.num_cv_train:self.num_train], y[self.num_cv_train:self.num_train]
-                print(fitted_model_params)
-                new_predictions = sess.run(
-                                        pred, 
-                                        feed_dict={
-                                            x_observed: train_x
-                                        }
-                                    )
-                print(new_predictions)
-                
-                optimizer.minimize(session=sess,
-                                   feed_dict={
-                                        x_observed: train_x,
-                                        y_truth: train_y
-                                    }
-                )
+                if self.sparse_input is True:
+                    x = self._series_x(i)
+                    y = ys[i]
+                    train_feed_dict = {
+                        graph['x_train']: self._feed_value(x[:, :self.num_cv_train]),
+                        graph['y_train']: y[:self.num_cv_train]
+                    }
+                    validation_feed_dict = {
+                        graph['x_validation']: self._feed_value(x[:, self.num_cv_train:self.num_train]),
+                        graph['y_validation']: y[self.num_cv_train:self.num_train]
+                    }
+                else:
+                    # move the prefetched series into the graph, the losses read it from there
+                    sess.run(graph['next_series'])
+                    train_feed_dict = None
+                    validation_feed_dict = None
+
+                if max_iterations > 0:
+                    optimizer.minimize(session=sess,
+                                       feed_dict=train_feed_dict
+                    )
+                    if self.l1_param > 0:
+                        self._proximal_l1_steps(sess, graph, train_feed_dict)
 
                 validation_loss = sess.run(
-                                            loss,
-                                            feed_dict={
-                                                        x_observed: validation_x,
-                                                        y_truth: validation_y
-                                                    }
+                                            graph['validation_loss'],
+                                            feed_dict=validation_feed_dict
                                         ) 
                 validation_loss_sum += validation_loss / self.num_of_series
                 
-            params_vals = sess.run([eta, mu, theta, C, c])
+            params_vals = sess.run(params_tensors)
             fitted_model_params = dict(zip(params_keys, params_vals)) 
+            fitted_model_params['mu'] = self._expand_mu(fitted_model_params['mu'])
             
         return validation_loss_sum, fitted_model_params
 
+    def _proximal_l1_steps(self, sess, graph, feed_dict):
+        """
+            Proximal gradient steps on mu after the L-BFGS fit. L-BFGS only
+            sees a subgradient of the l1 penalty and leaves small non-zero
+            weights, the soft-thresholding of the proximal step sets them
+            to exactly zero. The step size is halved until the smooth part
+            of the loss decreases sufficiently.
+        """
+        mu = graph['params']['mu']
+        step_size = 1.0
+        for _ in range(PROXIMAL_ITERATIONS):
+            mu_value, smooth_loss, gradient = sess.run(
+                [mu, graph['smooth_loss'], graph['mu_gradient']], feed_dict=feed_dict)
+            while step_size > 1e-10:
+                step_feed_dict = {graph['proximal_step_size']: step_size}
+                if feed_dict is not None:
+                    step_feed_dict.update(feed_dict)
+                new_mu_value = sess.run(graph['proximal_mu'], feed_dict=step_feed_dict)
+                mu.load(new_mu_value, sess)
+                difference = new_mu_value - mu_value
+                new_smooth_loss = sess.run(graph['smooth_loss'], feed_dict=feed_dict)
+                if new_smooth_loss <= (smooth_loss + np.sum(gradient * difference) +
+                                       np.sum(np.square(difference)) / (2 * step_size)):
+                    break
+                step_size /= 2
+            else:
+                mu.load(mu_value, sess)
+                return
+            if np.allclose(new_mu_value, mu_value):
+                return
+
+    def _build_fit_graph(self, iteration_number):
+        """
+            Build the training and validation graph of a single
+            initialization on a fresh default graph
+
+            Returns
+            -------
+                dictionary of the model variables, the inputs, the training
+                predictions and the two loss tensors. Dense series are read
+                from an input pipeline: 'pipeline_initializer' has to be run
+                once with 'pipeline_feed_dict' and 'next_series' before
+                fitting each series. Sparse series are fed to placeholders.
+                With an l1 penalty it also holds the tensors of the
+                proximal step on mu.
+        """
+        tf.reset_default_graph()
+        graph = dict()
+        num_validation = self.num_train - self.num_cv_train
+        if self.sparse_input is True:
+            x_train = self._series_placeholder('x_train', self.num_cv_train)
+            y_train = self._series_placeholder('y_train', self.num_cv_train, exogenous=False)
+            x_validation = self._series_placeholder('x_validation', num_validation)
+            y_validation = self._series_placeholder('y_validation', num_validation, exogenous=False)
+        else:
+            staged_xs, staged_ys = self._stage_series('fit')
+            (next_x, next_y), graph['pipeline_initializer'], graph['pipeline_feed_dict'] = \
+                self._build_series_pipeline(staged_xs, staged_ys)
+            # the optimizer evaluates the loss many times per series, so the
+            # current series is kept in variables instead of read from the iterator
+            x_series = tf.Variable(tf.zeros(staged_xs.shape[1:]), trainable=False, name='x_series')
+            y_series = tf.Variable(tf.zeros(staged_ys.shape[1:]), trainable=False, name='y_series')
+            graph['next_series'] = tf.group(x_series.assign(next_x), y_series.assign(next_y))
+            x_train, y_train = x_series[:, :self.num_cv_train], y_series[:self.num_cv_train]
+            x_validation = x_series[:, self.num_cv_train:self.num_train]
+            y_validation = y_series[self.num_cv_train:self.num_train]
+
+        params = self._init_tf_model_variables(random_seed=RANDOM_SEED + iteration_number)
+        with self._jit_scope():
+            pred = self.predict(x_train, params)
+            loss = self._loss(y_train, pred, params['mu'])
+            validation_pred = self.predict(x_validation, params)
+            validation_loss = self._loss(y_validation, validation_pred, params['mu'])
+        if self.l1_param > 0:
+            # the proximal step applies the l1 penalty, so its gradient only
+            # follows the rest of the loss
+            graph['smooth_loss'] = loss - self.l1_param * tf.reduce_sum(tf.abs(params['mu']))
+            graph['mu_gradient'] = tf.gradients(graph['smooth_loss'], params['mu'])[0]
+            graph['proximal_step_size'] = tf.placeholder(params['mu'].dtype.base_dtype, shape=(), name='proximal_step_size')
+            shifted_mu = params['mu'] - graph['proximal_step_size'] * graph['mu_gradient']
+            graph['proximal_mu'] = tf.sign(shifted_mu) * tf.maximum(
+                tf.abs(shifted_mu) - graph['proximal_step_size'] * self.l1_param, 0)
+
+        graph.update({
+            'params': params,
+            'x_train': x_train,
+            'y_train': y_train,
+            'x_validation': x_validation,
+            'y_validation': y_validation,
+            'pred': pred,
+            'loss': loss,
+            'validation_loss': validation_loss,
+        })
+        return graph
+
+    def _stage_series(self, mode):
+        """
+            float32 copies of the series used for fitting ('fit') or for
+            prediction ('predict'). They are converted once and reused by
+            every initialization and every call until the series change.
+        """
+        if mode not in self._staged_series:
+            if mode == 'fit':
+                xs = [self._series_x(i) for i in range(self.num_of_series)]
+                self._staged_series[mode] = (
+                    np.asarray(xs, dtype=np.float32),
+                    np.asarray(self.ys, dtype=np.float32)
+                )
+            else:
+                xs = [self._prediction_x(i) for i in range(self.num_of_series)]
+                self._staged_series[mode] = (np.asarray(xs, dtype=np.float32),)
+        return self._staged_series[mode]
+
+    def _build_series_pipeline(self, *arrays):
+        """
+            Input pipeline iterating over the staged series. The arrays are
+            fed once to initialize the iterator and the next series is
+            prefetched in the background while the current one is in use.
+
+            Returns
+            -------
+                the tensors of the next series, the iterator initializer
+                and the feed dict it has to be run with
+        """
+        placeholders = tuple(tf.placeholder(tf.float32, shape=array.shape) for array in arrays)
+        dataset = tf.data.Dataset.from_tensor_slices(placeholders).prefetch(1)
+        iterator = dataset.make_initializable_iterator()
+        return iterator.get_next(), iterator.initializer, dict(zip(placeholders, arrays))
+
     def _init_tf_model_variables(self, random_seed=RANDOM_SEED):
         tf.set_random_seed(random_seed)
         if 'mu' in self.model_params:
-            mu = tf.get_variable('mu', initializer=tf.constant(self.model_params['mu']))        
+            initial_mu = self.model_params['mu']
+            if self.active_features is not None:
+                initial_mu = initial_mu[:, self.active_features]
+            mu = tf.get_variable('mu', initializer=tf.constant(initial_mu))        
         else:
             mu = tf.get_variable(
                 name='mu',
-                shape=(1, self.num_of_exogenous_series),
+                shape=(1, self._num_active_features()),
                 initializer=tf.random_normal_initializer(mean=1, stddev=1, seed=random_seed)
             )
             
@@ -342,34 +781,44 @@ class TensorHIP():
         }
 
     def get_predictions(self):
+        predictions = self._get_scaled_predictions()
+        if self.scale_series is True:
+            return self.series_scaler.invert_transform_ys(predictions)
+        else:
+            return predictions
+
+    def _get_scaled_predictions(self):
         # predict future values for the test data
         # Instantiate a new model with the trained parameters
         tf.reset_default_graph()
-        x_observed = tf.placeholder(tf.float32, name='x_observed')
+        if self.sparse_input is True:
+            x_observed = self._series_placeholder('x_observed', self.series_length)
+        else:
+            (x_observed,), pipeline_initializer, pipeline_feed_dict = \
+                self._build_series_pipeline(*self._stage_series('predict'))
 
-        self._init_tf_model_variables()
+        params = self._init_tf_model_variables()
         
-        pred = self.predict(x_observed)
+        with self._jit_scope():
+            pred = self.predict(x_observed, params)
         predictions = []
 
-        with tf.Session() as sess:
+        with tf.Session(config=self._session_config()) as sess:
             sess.run(tf.global_variables_initializer())
+            if self.sparse_input is False:
+                sess.run(pipeline_initializer, feed_dict=pipeline_feed_dict)
             for i in range(self.num_of_series):    
-                if self.scale_series is True:
-                    x = self.series_scaler.transform_x(self.x[i])
+                if self.sparse_input is True:
+                    feed_dict = {x_observed: self._feed_value(self._prediction_x(i))}
                 else:
-                    x = self.x[i]
+                    # every run reads the next series from the pipeline
+                    feed_dict = None
                 new_predictions = sess.run(
                                         pred, 
-                                        feed_dict={
-                                            x_observed: x
-                                        }
+                                        feed_dict=feed_dict
                                     )
                 predictions.append(new_predictions)
-        if self.scale_series is True:
-            return self.series_scaler.invert_transform_ys(predictions)
-        else:
-            return predictions
+        return predictions
     
     def get_model_parameters(self):
         """
@@ -377,6 +826,258 @@ class TensorHIP():
         """
         return self.model_params.copy()
 
+    def bootstrap(self,
+                  num_samples=100,
+                  confidence=0.95,
+                  max_iterations=None,
+                  gradient_tolerance=1e-3,
+                  random_seed=RANDOM_SEED):
+        """
+            Estimate confidence intervals of the model parameters and
+            predictions with a residual bootstrap. The residuals of the
+            fitted model on the training data are resampled to build
+            `num_samples` synthetic target series, which are refit together
+            as one batched problem warm-started from the fitted parameters.
+
+            The samples share the stopping criteria of the batched L-BFGS-B
+            problem, which can stop while single samples still move. Every
+            sample whose projected gradient is still above
+            `gradient_tolerance` is refit on its own. The samples that do not
+            converge even then are left out of the intervals and counted in
+            'num_dropped_samples'.
+
+            Parameters
+            ----------
+            num_samples
+                number of bootstrap samples
+            confidence
+                confidence level of the returned intervals
+            max_iterations
+                maximum number of L-BFGS iterations of the batched fit and
+                of every refit of a single sample. Defaults to the
+                max_iterations of the model
+            gradient_tolerance
+                largest projected gradient entry of a converged sample
+
+            Returns
+            -------
+                dictionary mapping 'eta', 'mu', 'theta', 'C' and 'predictions'
+                to a (lower, upper) tuple of the interval bounds, and
+                'num_dropped_samples' to the number of samples left out
+        """
+        if 'mu' not in self.model_params:
+            self.train()
+        if max_iterations is None:
+            max_iterations = self.max_iterations
+        random_state = np.random.RandomState(random_seed)
+
+        fitted_predictions = self._get_scaled_predictions()
+        synthetic_ys = []
+        for i in range(self.num_of_series):
+            fit = fitted_predictions[i][:self.num_cv_train]
+            residuals = self.ys[i][:self.num_cv_train] - fit
+            resampled_residuals = random_state.choice(residuals, size=(num_samples, self.num_cv_train))
+            synthetic_ys.append(fit + resampled_residuals)
+
+        tf.reset_default_graph()
+        # float64 keeps the summed loss of all the samples resolving the
+        # changes of a single one, which float32 rounds away
+        x_train = self._series_placeholder('x_train', self.num_cv_train, dtype=tf.float64)
+        y_train = tf.placeholder(tf.float64, shape=(num_samples, self.num_cv_train), name='y_train')
+        x_observed = self._series_placeholder('x_observed', self.series_length, dtype=tf.float64)
+
+        # a zero weight takes a sample out of the optimization
+        sample_weights = tf.placeholder(tf.float64, shape=(num_samples,), name='sample_weights')
+
+        params = self._init_tf_bootstrap_variables(num_samples)
+        with self._jit_scope():
+            pred = self._predict_samples(x_train, params)
+            samples_loss = (
+                tf.sqrt(tf.reduce_sum(tf.square(y_train - pred), axis=1)) +
+                self.l1_param * (tf.reduce_sum(tf.abs(params['mu']), axis=1)) +
+                self.l2_param * (tf.reduce_sum(tf.square(params['mu']), axis=1))
+            )
+            loss = tf.reduce_sum(sample_weights * samples_loss)
+            samples_pred = self._predict_samples(x_observed, params)
+        variables = [params[key] for key in ['eta', 'mu', 'theta', 'C'] if isinstance(params[key], tf.Variable)]
+        var_to_bounds = {
+            params[key]: (PARAMS_LOWER_BOUNDS[key], np.infty)
+            for key in ['theta', 'C'] if params[key] in variables
+        }
+        optimizer = tf.contrib.opt.ScipyOptimizerInterface(
+                                                            loss,
+                                                            var_list=variables,
+                                                            var_to_bounds=var_to_bounds,
+                                                            method='L-BFGS-B',
+                                                            options={
+                                                                'maxiter': max_iterations,
+                                                                'gtol': gradient_tolerance
+                                                            }
+                                                        )
+        # a single sample has no other samples to stop it early, so its
+        # refit only stops on the projected gradient or the iteration limit
+        sample_optimizer = tf.contrib.opt.ScipyOptimizerInterface(
+                                                                   loss,
+                                                                   var_list=variables,
+                                                                   var_to_bounds=var_to_bounds,
+                                                                   method='L-BFGS-B',
+                                                                   options={
+                                                                       'maxiter': max_iterations,
+                                                                       'ftol': 0,
+                                                                       'gtol': gradient_tolerance
+                                                                   }
+                                                               )
+        gradients = tf.gradients(loss, variables)
+
+        def largest_gradients(sess, feed_dict):
+            # largest projected gradient entry of every sample, as checked
+            # by L-BFGS-B. The samples do not share parameters, so the
+            # gradient of a sample is its slice of the batched gradient.
+            values, gradient_values = sess.run([variables, gradients], feed_dict=feed_dict)
+            largest_gradient = np.zeros(num_samples)
+            for variable, value, gradient in zip(variables, values, gradient_values):
+                if value.size == 0:
+                    continue
+                lower_bound = var_to_bounds.get(variable, (-np.infty, np.infty))[0]
+                projected_gradient = np.abs(np.maximum(value - gradient, lower_bound) - value)
+                largest_gradient = np.maximum(largest_gradient,
+                                              projected_gradient.reshape(num_samples, -1).max(axis=1))
+            return largest_gradient
+
+        params_keys = ['eta', 'mu', 'theta', 'C']
+        samples_predictions = []
+        converged = np.ones(num_samples, dtype=bool)
+        with tf.Session(config=self._session_config()) as sess:
+            sess.run(tf.global_variables_initializer())
+            for i in range(self.num_of_series):
+                self.print_log("--- Fitting bootstrap samples of target series #{}".format(i + 1))
+                feed_dict = {
+                    x_train: self._feed_value(self._series_x(i)[:, :self.num_cv_train]),
+                    y_train: synthetic_ys[i],
+                    sample_weights: np.ones(num_samples)
+                }
+                optimizer.minimize(session=sess, feed_dict=feed_dict)
+                series_converged = largest_gradients(sess, feed_dict) <= gradient_tolerance
+                for sample in np.flatnonzero(~series_converged):
+                    self.print_log("Refitting bootstrap sample #{}".format(sample + 1))
+                    sample_feed_dict = dict(feed_dict)
+                    sample_feed_dict[sample_weights] = (np.arange(num_samples) == sample).astype(float)
+                    sample_optimizer.minimize(session=sess, feed_dict=sample_feed_dict)
+                series_converged = largest_gradients(sess, feed_dict) <= gradient_tolerance
+                converged &= series_converged
+
+            params_samples = dict(zip(params_keys, sess.run([params[key] for key in params_keys])))
+            for i in range(self.num_of_series):
+                samples_predictions.append(sess.run(samples_pred,
+                                                    feed_dict={x_observed: self._feed_value(self._prediction_x(i))}))
+
+        params_samples['mu'] = np.stack([self._expand_mu(mu[np.newaxis])[0] for mu in params_samples['mu']])
+        if self.scale_series is True:
+            # predictions of each series have a shape of (num_samples, series_length)
+            samples_predictions = [
+                self.series_scaler.y_mins[i] +
+                samples_predictions[i] * (self.series_scaler.y_maxs[i] - self.series_scaler.y_mins[i])
+                for i in range(self.num_of_series)
+            ]
+        params_samples['predictions'] = np.stack(samples_predictions, axis=1)
+
+        if not converged.all():
+            logging.warning("{} of {} bootstrap samples did not converge even when refit on their own "
+                            "and are left out of the intervals".format(num_samples - converged.sum(), num_samples))
+            if not converged.any():
+                raise RuntimeError("No bootstrap sample converged, increase max_iterations or gradient_tolerance")
+            for key, samples in params_samples.items():
+                if np.ndim(samples) > 0:
+                    params_samples[key] = samples[converged]
+
+        percentiles = [50 * (1 - confidence), 50 * (1 + confidence)]
+        intervals = dict()
+        for key, samples in params_samples.items():
+            # fixed parameters are shared by all samples
+            lower, upper = np.percentile(np.atleast_1d(samples), percentiles, axis=0)
+            if key == 'mu':
+                lower, upper = lower[np.newaxis], upper[np.newaxis]
+            intervals[key] = (lower, upper)
+        intervals['num_dropped_samples'] = num_samples - converged.sum()
+        return intervals
+
+    def _init_tf_bootstrap_variables(self, num_samples):
+        """
+            Variables holding one copy of the fitted parameters per
+            bootstrap sample. Fixed parameters stay shared constants.
+        """
+        params = dict()
+        fixed_params = {'eta': self.fixed_eta, 'theta': self.fixed_theta, 'C': self.fixed_C}
+        for key, fixed in fixed_params.items():
+            value = np.float64(self.model_params[key])
+            if fixed is True:
+                params[key] = tf.constant(value)
+            else:
+                params[key] = tf.get_variable(key, initializer=tf.constant(np.full(num_samples, value)))
+
+        mu = self.model_params['mu']
+        if self.active_features is not None:
+            mu = mu[:, self.active_features]
+        params['mu'] = tf.get_variable(
+                                       'mu',
+                                       initializer=tf.constant(np.tile(mu, (num_samples, 1)).astype(np.float64))
+                                      )
+        return params
+
+    def _predict_samples(self, x, model_params):
+        """
+            Batched variant of `predict` evaluating the recursion for every
+            parameter sample at once. Every parameter either has a leading
+            sample dimension or is shared between all samples.
+
+            Returns
+            -------
+                predictions of shape (num_samples, series_length)
+        """
+        mu = model_params['mu']
+        if isinstance(x, tf.SparseTensor):
+            with tf.contrib.compiler.jit.experimental_jit_scope(compile_ops=False):
+                exogenous = tf.transpose(tf.sparse_tensor_dense_matmul(x, mu, adjoint_a=True, adjoint_b=True))
+        elif self.num_of_exogenous_series == 0:
+            # x only holds zeros standing in for the missing exogenous series
+            exogenous = tf.zeros([tf.shape(mu)[0], tf.shape(x)[1]], dtype=mu.dtype)
+        else:
+            exogenous = tf.matmul(mu, x)
+        return self._predict_batch(exogenous, model_params)
+
+    def _predict_batch(self, exogenous, model_params):
+        """
+            Recursion of `_predict_static` run for a batch of series at once
+
+            Parameters
+            ----------
+            exogenous
+                exogenous contribution of shape (batch_size, series_length)
+            model_params
+                model parameters, each one either with a leading batch
+                dimension or shared by the whole batch
+
+            The recursion runs in the dtype of exogenous.
+        """
+        dtype = exogenous.dtype
+        lags = tf.cast(tf.range(MEMORY_WINDOW, 0, -1), dtype)
+        kernel = tf.pow(lags + 1 + tf.constant(0.01, dtype=dtype), tf.expand_dims(-1 - model_params['theta'], -1))
+        num_samples = tf.shape(exogenous)[0]
+
+        def step(state, exogenous_values):
+            history, _ = state
+            endogenous = model_params['C'] * tf.reduce_sum(history * kernel, axis=1)
+            new_predictions = model_params['eta'] + exogenous_values + endogenous
+            history = tf.concat([history[:, 1:], tf.expand_dims(new_predictions, -1)], axis=1)
+            return history, new_predictions
+
+        _, predictions = tf.scan(
+                                 step,
+                                 tf.transpose(exogenous),
+                                 initializer=(tf.zeros([num_samples, MEMORY_WINDOW], dtype=dtype), tf.zeros([num_samples], dtype=dtype))
+                                )
+        return tf.transpose(predictions)
+
     def get_validation_rmse(self):
         predictions = self.get_predictions()
         validation_split_start = self.num_cv_train
@@ -411,59 +1112,12 @@ class TensorHIP():
         return ret_val
 
     def get_params_df(self):
+        import pandas as pd
+
         params_df = pd.DataFrame([{'eta': self.model_params['eta'], 'theta': self.model_params['theta']}])
         mu_df = pd.DataFrame([self.get_weights_dict()], columns=['mu'])
         return pd.concat([params_df, mu_df], axis=1)
 
     def plot(self, ax=None):
-        predictions = self.get_predictions()
-        
-        num_of_series = len(predictions)
-        data_length = len(predictions[0])
-        data_test_split_point = self.num_train
-
-        srows = (int)(np.ceil(np.sqrt(num_of_series)))
-
-        display_plot = False
-
-        if ax is None:
-            display_plot = True
-            fig, axes = plt.subplots(srows, srows, sharex='all')
-            fig.set_figheight(10)
-            fig.set_figwidth(20)
-
-        for i in range(num_of_series):
-            row = (int)(i / srows)
-            col = (int)(i % srows)
-            truth = self.y[i]
-
-            pred = predictions[i]
-            if display_plot:
-                if num_of_series == 1:
-                    ax = plt
-                else:
-                    ax = axes[row, col]
-            ax.axvline(data_test_split_point, color='k')
-            ax.plot(np.arange(data_length - 1), truth[:-1], 'k--', label='Observed #views')
-
-            # plot predictions on training data with a different alpha to make the plot more clear            
-            ax.plot(
-                        np.arange(data_test_split_point+1),
-                        pred[:data_test_split_point+1], 
-                        'b-',
-                        alpha=0.5,
-                        label='Model Fit'
-                    )
-            ax.plot(
-                        np.arange(data_test_split_point, data_length-1),
-                        pred[data_test_split_point:-1], 
-                        'b-',
-                        alpha=1,
-                        label='Model Predictions'
-                    )
-        ax.legend()
-        # ax.set_xlabel("Day")
-        # ax.set_ylabel("Occurances")
-        if display_plot is True:
-            plt.show()
-            
\ No newline at end of file
+        from hip.plotting import plot_model
+        plot_model(self, ax=ax)
@@ -0,0 +1,109 @@
+import matplotlib.pyplot as plt
+import numpy as np
+
+def plot_predictions(y_truth, y_predictions, xs=None, train_test_split_point=0.8, legend=True):
+        """
+            Plot the current predictions from the fitted model 
+        """
+        num_of_series = len(y_truth)
+        data_length = len(y_truth[0])
+        data_test_split_point = (int)(data_length * train_test_split_point)
+
+        srows = (int)(np.ceil(np.sqrt(num_of_series)))
+
+        fig, axes = plt.subplots(srows, srows, sharex='all')
+        for i in range(num_of_series):
+            row = (int)(i / srows)
+            col = (int)(i % srows)
+
+            truth = y_truth[i]
+            pred = y_predictions[i]
+
+            if num_of_series == 1:
+                ax = plt
+            else:
+                ax = axes[row, col]
+
+            ax.axvline(data_test_split_point, color='k')
+            ax.plot(np.arange(data_length), truth, 'k--', label='Observed #views')
+
+            if xs is not None:
+                x = xs[i]
+                
+                colors = iter(plt.cm.rainbow(np.linspace(0, 1, len(x))))
+                for index, exo_source in enumerate(x):
+                    c = next(colors)
+                    ax.plot(np.arange(data_length), exo_source, c=c, alpha=0.3)
+
+            # plot predictions on training data with a different alpha to make the plot more clear            
+            ax.plot(
+                        np.arange(data_test_split_point+1),
+                        pred[:data_test_split_point+1], 
+                        'b-',
+                        alpha=0.5,
+                        label='Model Fit'
+                    )
+            ax.plot(
+                        np.arange(data_test_split_point, data_length),
+                        pred[data_test_split_point:], 
+                        'b-',
+                        alpha=1,
+                        label='Model Predictions'
+                    )
+
+        plt.show()
+
+def plot_model(model, ax=None):
+        """
+            Plot the observed series and the predictions of a fitted TensorHIP model
+        """
+        predictions = model.get_predictions()
+        
+        num_of_series = len(predictions)
+        data_length = len(predictions[0])
+        data_test_split_point = model.num_train
+
+        srows = (int)(np.ceil(np.sqrt(num_of_series)))
+
+        display_plot = False
+
+        if ax is None:
+            display_plot = True
+            fig, axes = plt.subplots(srows, srows, sharex='all')
+            fig.set_figheight(10)
+            fig.set_figwidth(20)
+
+        for i in range(num_of_series):
+            row = (int)(i / srows)
+            col = (int)(i % srows)
+            truth = model.y[i]
+
+            pred = predictions[i]
+            if display_plot:
+                if num_of_series == 1:
+                    ax = plt
+                else:
+                    ax = axes[row, col]
+            ax.axvline(data_test_split_point, color='k')
+            ax.plot(np.arange(data_length - 1), truth[:-1], 'k--', label='Observed #views')
+
+            # plot predictions on training data with a different alpha to make the plot more clear            
+            ax.plot(
+                        np.arange(data_test_split_point+1),
+                        pred[:data_test_split_point+1], 
+                        'b-',
+                        alpha=0.5,
+                        label='Model Fit'
+                    )
+            ax.plot(
+                        np.arange(data_test_split_point, data_length-1),
+                        pred[data_test_split_point:-1], 
+                        'b-',
+                        alpha=1,
+                        label='Model Predictions'
+                    )
+        ax.legend()
+        # ax.set_xlabel("Day")
+        # ax.set_ylabel("Occurances")
+        if display_plot is True:
+            plt.show()
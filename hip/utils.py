@@ -1,9 +1,10 @@
 import csv  
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
+from scipy import sparse
 
 def load_data_from_csv(filename):
+    import pandas as pd
+
     raw_data_df = pd.read_csv(filename)
     # always assume that the last column in the CSV file is the target series
     # and the rest are time-series data for the features
@@ -24,56 +25,9 @@ def print_params_to_tsv(params, feature_name):
     print('\t'.join([str(x) for x in param_values]))
 
 def plot_predictions(y_truth, y_predictions, xs=None, train_test_split_point=0.8, legend=True):
-        """
-            Plot the current predictions from the fitted model 
-        """
-        num_of_series = len(y_truth)
-        data_length = len(y_truth[0])
-        data_test_split_point = (int)(data_length * train_test_split_point)
-
-        srows = (int)(np.ceil(np.sqrt(num_of_series)))
-
-        fig, axes = plt.subplots(srows, srows, sharex='all')
-        for i in range(num_of_series):
-            row = (int)(i / srows)
-            col = (int)(i % srows)
-
-            truth = y_truth[i]
-            pred = y_predictions[i]
-
-            if num_of_series == 1:
-                ax = plt
-            else:
-                ax = axes[row, col]
-
-            ax.axvline(data_test_split_point, color='k')
-            ax.plot(np.arange(data_length), truth, 'k--', label='Observed #views')
-
-            if xs is not None:
-                x = xs[i]
-                
-                colors = iter(plt.cm.rainbow(np.linspace(0, 1, len(x))))
-                for index, exo_source in enumerate(x):
-                    c = next(colors)
-                    ax.plot(np.arange(data_length), exo_source, c=c, alpha=0.3)
-
-            # plot predictions on training data with a different alpha to make the plot more clear            
-            ax.plot(
-                        np.arange(data_test_split_point+1),
-                        pred[:data_test_split_point+1], 
-                        'b-',
-                        alpha=0.5,
-                        label='Model Fit'
-                    )
-            ax.plot(
-                        np.arange(data_test_split_point, data_length),
-                        pred[data_test_split_point:], 
-                        'b-',
-                        alpha=1,
-                        label='Model Predictions'
-                    )
-
-        plt.show()
+        # matplotlib is only imported when plotting is used
+        from hip.plotting import plot_predictions
+        plot_predictions(y_truth, y_predictions, xs=xs, train_test_split_point=train_test_split_point, legend=legend)
 
 def get_test_rmse(truth, predictions, train_test_split=0.8):
         loss = 0
@@ -87,31 +41,161 @@ def get_test_rmse(truth, predictions, train_test_split=0.8):
     
         return loss
 
+def lagged_cross_correlations(xs, y, max_lag):
+        """
+            Normalized cross-correlation between every exogenous series in xs
+            and the target series y at the lags 0..max_lag, computed for all
+            the series at once with FFT. At lag k the exogenous series is
+            compared with the target k steps later.
+
+            Returns an array of shape (num_of_exogenous_series, max_lag + 1)
+        """
+        xs = np.asarray(xs, dtype=float)
+        y = np.asarray(y, dtype=float)
+        series_length = y.shape[0]
+        # larger lags would read the wrapped around negative lags of the FFT
+        if not 0 <= max_lag < series_length:
+            raise ValueError("max_lag has to be in the range 0..{} for series of length {}, got {}".format(
+                series_length - 1, series_length, max_lag))
+
+        xs = xs - xs.mean(axis=1, keepdims=True)
+        y = y - y.mean()
+        # zero-pad to avoid the circular wrap-around of the FFT correlation
+        fft_size = 2 ** int(np.ceil(np.log2(2 * series_length - 1)))
+        xs_fft = np.fft.rfft(xs, fft_size, axis=1)
+        y_fft = np.fft.rfft(y, fft_size)
+        correlations = np.fft.irfft(np.conj(xs_fft) * y_fft, fft_size, axis=1)[:, :max_lag + 1]
+
+        norms = np.linalg.norm(xs, axis=1) * np.linalg.norm(y)
+        norms[norms == 0] = np.inf
+        return correlations / norms[:, np.newaxis]
+
+def rank_features(xs, ys, max_lag=0):
+        """
+            Rank the exogenous series by the strength of their lagged
+            correlation with the target, averaged over all the target series
+
+            Parameters
+            ----------
+            xs
+                exogenous series of each target series, as returned by load_data_from_csv
+            ys
+                target series
+            max_lag
+                largest lag considered
+
+            Returns the feature indices sorted from the most to the least
+            relevant, and the best lag and correlation of every feature
+        """
+        correlations = np.mean([lagged_cross_correlations(x, y, max_lag) for x, y in zip(xs, ys)], axis=0)
+        best_lags = np.argmax(np.abs(correlations), axis=1)
+        scores = correlations[np.arange(len(correlations)), best_lags]
+        ranking = np.argsort(-np.abs(scores), kind='mergesort')
+        return ranking, best_lags, scores
+
+def shift_series(x, lags):
+        """
+            Delay every exogenous series in x by its lag so the value
+            observed at time t is used for the prediction at time t + lag
+        """
+        x = np.asarray(x, dtype=float)
+        lags = np.asarray(lags)
+        if np.any(lags < 0) or np.any(lags >= x.shape[1]):
+            raise ValueError("lags have to be in the range 0..{} for series of length {}, got {}".format(
+                x.shape[1] - 1, x.shape[1], lags))
+        shifted_x = np.zeros_like(x)
+        for index, lag in enumerate(lags):
+            shifted_x[index, lag:] = x[index, :x.shape[1] - lag]
+        return shifted_x
+
 class TimeSeriesScaler():
     def __init__(self):
+        self.x_mins = []
+        self.x_maxs = []
         self.y_mins = []
         self.y_maxs = []
 
-    def transform_x(self, x):
+    def _x_range(self, x):
+        """
+            Minimum and maximum used to scale an exogenous series.
+            Series without positive values are left as they are.
+        """
         x_min = np.min(x)
         x_max = np.max(x)
 
         if x_max > 0:
-            return (x - x_min) / (x_max - x_min)
+            return x_min, x_max
         else:
-            return x
+            return 0., 1.
+
+    def transform_x(self, x):
+        if sparse.issparse(x):
+            # shifting by the minimum would fill in the zero entries
+            x_max = abs(x).max()
+            if x_max > 0:
+                return x / x_max
+            else:
+                return x
+
+        x_min, x_max = self._x_range(x)
+        return (x - x_min) / (x_max - x_min)
 
     def transform_xs(self, xs):
+        self.x_mins = []
+        self.x_maxs = []
+
         scaled_xs = []
         for x_series in xs:
             scaled_x_series = []
+            x_series_ranges = []
             for x in x_series:
                 scaled_x = self.transform_x(x)
 
                 scaled_x_series.append(scaled_x)
+                x_series_ranges.append(self._x_range(x))
             scaled_xs.append(scaled_x_series)
+            self.x_mins.append(np.asarray([x_min for x_min, _ in x_series_ranges]))
+            self.x_maxs.append(np.asarray([x_max for _, x_max in x_series_ranges]))
 
         return np.asarray(scaled_xs)
+
+    def transform_sparse_xs(self, xs):
+        """
+            Scale every exogenous series (row) of the sparse matrices by its
+            maximum absolute value, which leaves the zero entries untouched
+        """
+        self.x_mins = []
+        self.x_maxs = []
+
+        scaled_xs = []
+        for x_series in xs:
+            row_max = abs(x_series).max(axis=1).toarray().ravel()
+            row_max[row_max == 0] = 1
+            scaled_xs.append(sparse.diags(1 / row_max).dot(x_series).tocsr())
+
+            self.x_mins.append(np.zeros_like(row_max))
+            self.x_maxs.append(row_max)
+
+        return scaled_xs
+
+    def invert_transform_xs(self, scaled_xs):
+        rescaled_xs = []
+        for index, scaled_x_series in enumerate(scaled_xs):
+            x_ranges = self.x_maxs[index] - self.x_mins[index]
+            if sparse.issparse(scaled_x_series):
+                # sparse series are scaled without a shift
+                rescaled_x_series = sparse.diags(x_ranges).dot(scaled_x_series).tocsr()
+            else:
+                rescaled_x_series = (
+                                        scaled_x_series * x_ranges[:, np.newaxis] +
+                                        self.x_mins[index][:, np.newaxis]
+                                    )
+
+            rescaled_xs.append(rescaled_x_series)
+
+        if len(rescaled_xs) > 0 and sparse.issparse(rescaled_xs[0]):
+            return rescaled_xs
+        return np.asarray(rescaled_xs)
     
     def transform_add_y(self, y):
         y_min = np.min(y)
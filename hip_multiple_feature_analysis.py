@@ -5,14 +5,22 @@ import sys
 import time
 
 from hip.models import TensorHIP
-from hip.utils import load_data_from_csv, print_params_to_tsv
+from hip.utils import load_data_from_csv, print_params_to_tsv, rank_features, shift_series
 
 if __name__ == '__main__':
     sys.stderr.write("loading the files\n")
     sys.stderr.flush()
     
-    if len(sys.argv) == 2:
+    # optionally keep only the top_k features most correlated with the target
+    # and shift each of them by its best lag in the range 0..max_lag
+    top_k = None
+    max_lag = 0
+    if 2 <= len(sys.argv) <= 4:
         input_path = sys.argv[1]
+        if len(sys.argv) >= 3:
+            top_k = int(sys.argv[2])
+        if len(sys.argv) == 4:
+            max_lag = int(sys.argv[3])
     else:
         raise SyntaxError("Insufficient arguments")
 
@@ -29,6 +37,23 @@ if __name__ == '__main__':
             input_feature_names = feature_names
             ys.append(target)
             file_paths.append(file_path)
+
+    if top_k is not None:
+        sys.stderr.write("screening the features\n")
+        sys.stderr.flush()
+        # rank on the part of the series the models are fitted on, so the
+        # validation and test values do not influence the selection. The
+        # split is read from a model built like the ones trained below.
+        num_cv_train = TensorHIP(xs=xs, ys=ys).num_cv_train
+        ranking, best_lags, scores = rank_features([x[:, :num_cv_train] for x in xs],
+                                                   [y[:num_cv_train] for y in ys],
+                                                   max_lag=max_lag)
+        selected = ranking[:top_k]
+        for index in selected:
+            sys.stderr.write("{}\tlag={}\tcorrelation={:.4f}\n".format(
+                input_feature_names[index], best_lags[index], scores[index]))
+        xs = [shift_series(x[selected], best_lags[selected]) for x in xs]
+        input_feature_names = [input_feature_names[index] for index in selected]
     
     sys.stderr.write("beginning the training\n")
     sys.stderr.flush()